@@ -0,0 +1,108 @@
+import os
+import pickle
+
+from tt import xmlschema
+from tt.xmlschema import Analysis
+
+
+myDir = os.path.dirname(os.path.abspath(__file__))
+resDir = f"{myDir}/resources"
+teiSchema = f"{myDir}/../../tt/tei/tei_all.xsd"
+
+
+def readExpected(name):
+    with open(f"{resDir}/{name}") as fh:
+        return fh.read().rstrip("\n")
+
+
+def test_analyse():
+    A = Analysis(f"{resDir}/MD.xsd", cache=False)
+    assert A.good
+    assert A.interpret(asTsv=True) == readExpected("MD.tsv")
+
+
+def test_self_reference_and_cycle():
+    """An element that extends a type with its own name refers to itself.
+
+    Elements in or below a cycle of substitution groups must still be resolved.
+    """
+    A = Analysis(f"{resDir}/selfref.xsd", cache=False)
+    assert A.interpret() == (
+        ("q", "complex", True),
+        ("x", "complex", True),
+        ("y", "complex", True),
+        ("z", "complex", True),
+    )
+
+
+def test_override():
+    A = Analysis(teiSchema, override=f"{resDir}/MD.xsd", cache=False)
+    assert A.good
+    assert A.interpret(asTsv=True) == readExpected("TEI-MD.tsv")
+
+    changing = {name: trans for (name, trans) in A.overrides.items() if trans}
+    assert changing == {"address": "pure ==> mixed"}
+
+
+SCHEMA_A = """<xs:schema xmlns:xs="http://www.w3.org/2001/XMLSchema">
+  <xs:element name="a"><xs:complexType mixed="true"/></xs:element>
+</xs:schema>
+"""
+
+SCHEMA_B = """<xs:schema xmlns:xs="http://www.w3.org/2001/XMLSchema">
+  <xs:element name="b"><xs:simpleType/></xs:element>
+  <!-- padding so that the file size differs from schema A -->
+</xs:schema>
+"""
+
+
+def writeSchema(path, text):
+    with open(path, "w") as fh:
+        fh.write(text)
+
+
+def test_cache(tmp_path, monkeypatch):
+    monkeypatch.setattr(xmlschema, "CACHE_DIR", str(tmp_path / "cache"))
+    schema = str(tmp_path / "a.xsd")
+    writeSchema(schema, SCHEMA_A)
+
+    expected = (("a", "complex", True),)
+
+    A = Analysis(schema)
+    assert A.root is not None
+    assert A.interpret() == expected
+
+    A = Analysis(schema)
+    assert A.root is None
+    assert A.interpret() == expected
+
+    assert not [
+        name for name in os.listdir(xmlschema.CACHE_DIR) if not name.endswith(".pkl")
+    ]
+
+
+def test_cache_schema_changed_before_interpret(tmp_path, monkeypatch):
+    """The interpretation must not be cached under the key of a newer file."""
+    monkeypatch.setattr(xmlschema, "CACHE_DIR", str(tmp_path / "cache"))
+    schema = str(tmp_path / "a.xsd")
+    writeSchema(schema, SCHEMA_A)
+
+    A = Analysis(schema)
+    writeSchema(schema, SCHEMA_B)
+    assert A.interpret() == (("a", "complex", True),)
+
+    assert Analysis(schema).interpret() == (("b", "simple", False),)
+
+
+def test_cache_write_failure(tmp_path, monkeypatch):
+    monkeypatch.setattr(xmlschema, "CACHE_DIR", str(tmp_path / "cache"))
+    schema = str(tmp_path / "a.xsd")
+    writeSchema(schema, SCHEMA_A)
+
+    def failingDump(*args, **kwargs):
+        raise pickle.PicklingError("failing on purpose")
+
+    monkeypatch.setattr(xmlschema.pickle, "dump", failingDump)
+
+    assert Analysis(schema).interpret() == (("a", "complex", True),)
+    assert os.listdir(xmlschema.CACHE_DIR) == []
@@ -1,6 +1,9 @@
 import sys
 import os
 import re
+import mmap
+from itertools import repeat
+from concurrent.futures import ThreadPoolExecutor
 from subprocess import run
 from shutil import rmtree, copy
 
@@ -26,6 +29,36 @@ Command switches
 """
 
 
+NBEXT = ".ipynb"
+
+# links to notebooks, to be redirected to their html conversions
+LINK_RE = re.compile(
+    rb"""
+        \b
+        (
+            (?:
+                href|src
+            )
+            =
+            ['"]
+            (?:
+                [^'"]*/
+            )?
+        )
+        (
+            [^'"/]+
+        )
+        (?:
+            \.ipynb
+        )
+        (
+            ['"]
+        )
+    """,
+    re.X,
+)
+
+
 def normpath(path):
     return None if path is None else path.replace("\\", "/")
 
@@ -35,7 +68,7 @@ HOME_DIR = normpath(os.path.expanduser("~"))
 
 def expanduser(path):
     nPath = normpath(path)
-    if nPath.startswith("~"):
+    if nPath[:1] == "~":
         return f"{HOME_DIR}{nPath[1:]}"
 
     return nPath
@@ -78,21 +111,20 @@ def clearTree(path):
         home directory.
     """
 
-    subdirs = []
-    path = expanduser(path)
+    def onError(e):
+        raise e
+
+    for (thisPath, dirs, files) in os.walk(expanduser(path), onerror=onError):
+        # hidden directories are left alone, and so is their content
+        dirs[:] = [name for name in dirs if not name.startswith(".")]
 
-    with os.scandir(path) as dh:
-        for (i, entry) in enumerate(dh):
-            name = entry.name
+        for name in files:
             if name.startswith("."):
                 continue
-            if entry.is_file():
-                os.remove(f"{path}/{name}")
-            elif entry.is_dir():
-                subdirs.append(name)
-
-    for subdir in subdirs:
-        clearTree(f"{path}/{subdir}")
+            try:
+                os.remove(f"{thisPath}/{name}")
+            except FileNotFoundError:
+                pass
 
 
 def initTree(path, fresh=False, gentle=False):
@@ -127,23 +159,131 @@ def initTree(path, fresh=False, gentle=False):
         os.makedirs(path, exist_ok=True)
 
 
+def convertNotebooks(notebookGroups):
+    """Converts groups of notebooks to html.
+
+    If the `nbconvert` package can be imported, all groups are converted by a
+    single `NbConvertApp`, so that the start-up costs of jupyter are paid only once.
+    Otherwise we fall back to a `jupyter nbconvert` command per group.
+
+    If the conversion of a group fails, we convert its remaining notebooks
+    one by one, and report the ones that fail.
+
+    Parameters
+    ----------
+    notebookGroups: list of tuple
+        Each member consists of an input directory, an output directory and the
+        names of the notebooks in that input directory.
+    """
+    try:
+        from nbconvert.nbconvertapp import NbConvertApp
+    except ImportError:
+        NbConvertApp = None
+
+    if NbConvertApp is None:
+        for (inDir, outDir, notebooks) in notebookGroups:
+            commandLine = [
+                "jupyter",
+                "nbconvert",
+                "--to",
+                "html",
+                f"--output-dir={outDir}",
+                *(f"{inDir}/{name}" for name in notebooks),
+            ]
+            print(" ".join(commandLine))
+            try:
+                returnCode = run(commandLine).returncode
+            except FileNotFoundError:
+                print("Cannot run jupyter, is it installed?")
+                return
+            if returnCode:
+                print(f"Could not convert all notebooks in {inDir}")
+        return
+
+    app = NbConvertApp()
+    app.initialize(argv=["--to", "html"])
+
+    for (inDir, outDir, notebooks) in notebookGroups:
+        print(f"converting {len(notebooks)} notebook(s) in {inDir} to {outDir}")
+        app.writer.build_directory = outDir
+        app.notebooks = [f"{inDir}/{name}" for name in notebooks]
+        try:
+            app.convert_notebooks()
+        except (Exception, SystemExit):
+            for name in notebooks:
+                if fileExists(f"{outDir}/{name.replace(NBEXT, '')}.html"):
+                    continue
+                app.notebooks = [f"{inDir}/{name}"]
+                try:
+                    app.convert_notebooks()
+                except (Exception, SystemExit) as e:
+                    # nbconvert logs the reason itself before it exits
+                    print(f"Could not convert {inDir}/{name}")
+                    if not isinstance(e, SystemExit):
+                        print(str(e))
+
+
+def fixLinks(pathName, converted):
+    """Redirects the links to converted notebooks in an html file.
+
+    The file is not read into memory, but mapped, and the result is streamed to
+    a temporary file, which then replaces the original file.
+    Files without links to notebooks are left untouched.
+
+    Parameters
+    ----------
+    pathName: string
+        The path of the html file.
+    converted: frozenset
+        The bare names of the converted notebooks, as utf8 encoded bytes.
+    """
+    tmpName = f"{pathName}.tmp"
+
+    with open(pathName, "rb") as fh:
+        if os.fstat(fh.fileno()).st_size == 0:
+            return
+
+        with mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            # a plain search is much cheaper than running the regex,
+            # and many files do not mention notebooks at all
+            if mm.find(b".ipynb") == -1:
+                return
+
+            with memoryview(mm) as text, open(tmpName, "wb") as out:
+                pos = 0
+
+                for match in LINK_RE.finditer(mm):
+                    if match.group(2) in converted:
+                        out.write(text[pos : match.end(2)])
+                        out.write(b".html")
+                        out.write(match.group(3))
+                        pos = match.end()
+
+                out.write(text[pos:])
+
+    if pos == 0:
+        os.remove(tmpName)
+    else:
+        os.replace(tmpName, pathName)
+
+
 def task(inputDir, outputDir):
+    # normalize the paths once, all other paths are derived from them
+    inputDir = expanduser(inputDir)
+    outputDir = expanduser(outputDir)
+
     if not os.path.isdir(inputDir):
         print(f"Input directory does not exist: {inputDir}")
         return 1
     initTree(outputDir, fresh=True)
 
-    nbext = ".ipynb"
-
+    notebookGroups = []
     convertedNotebooks = []
 
-    def escapeSpace(x):
-        return x.replace(" ", "\\ ")
-
     def doSubDir(path):
         subInputDir = inputDir if path == "" else f"{inputDir}/{path}"
         subOutputDir = outputDir if path == "" else f"{outputDir}/{path}"
-        initTree(subOutputDir)
+        os.makedirs(subOutputDir, exist_ok=True)
 
         theseNotebooks = []
 
@@ -153,66 +293,40 @@ def task(inputDir, outputDir):
                 subPath = name if path == "" else f"{path}/{name}"
                 if entry.is_dir():
                     doSubDir(subPath)
-                elif name.endswith(nbext):
+                elif name.endswith(NBEXT):
                     theseNotebooks.append(name)
-                else:
-                    if not name.startswith("."):
-                        fileCopy(f"{subInputDir}/{name}", f"{subOutputDir}/{name}")
+                elif not name.startswith(".") and entry.is_file():
+                    # the output tree has been freshly created, so there is
+                    # nothing to wipe at the destination
+                    copy(f"{subInputDir}/{name}", f"{subOutputDir}/{name}")
 
         if len(theseNotebooks):
-            command = "jupyter nbconvert --to html"
-            inFiles = " ".join(
-                f"{subInputDir}/{escapeSpace(name)}" for name in theseNotebooks
-            )
-            commandLine = f"{command} --output-dir={subOutputDir} {inFiles}"
-            print(commandLine)
-            run(commandLine, shell=True)
-            for thisNotebook in theseNotebooks:
-                convertedNotebooks.append(
-                    (subOutputDir, thisNotebook.replace(nbext, ""))
-                )
+            notebookGroups.append((subInputDir, subOutputDir, theseNotebooks))
 
     doSubDir("")
-    convertedPat = ")|(?:".join(re.escape(c[1]) for c in convertedNotebooks)
-
-    LINK_RE = re.compile(
-        rf"""
-            \b
-            (
-                (?:
-                    href|src
-                )
-                =
-                ['"]
-                (?:
-                    [^'"]*/
-                )?
-                (?:
-                    {convertedPat}
-                )
-            )
-            (?:
-                {nbext}
-            )
-            (
-                ['"]
-            )
-        """,
-        re.X,
-    )
+    convertNotebooks(notebookGroups)
 
-    def processLinks(text):
-        return LINK_RE.sub(r"\1.html\2", text)
+    # The output tree is fresh, so a notebook has been converted if and only if
+    # its html file exists. Failed notebooks are left out.
+    for (subInputDir, subOutputDir, theseNotebooks) in notebookGroups:
+        for thisNotebook in theseNotebooks:
+            name = thisNotebook.replace(NBEXT, "")
+            if fileExists(f"{subOutputDir}/{name}.html"):
+                convertedNotebooks.append((subOutputDir, name))
+    converted = frozenset(c[1].encode("utf8") for c in convertedNotebooks)
+
+    pathNames = [f"{path}/{name}.html" for (path, name) in convertedNotebooks]
 
     print("fixing links to converted notebooks:")
-    for (path, name) in convertedNotebooks:
-        pathName = f"{path}/{name}.html"
-        print(pathName)
-        with open(pathName) as fh:
-            text = fh.read()
-        text = processLinks(text)
-        with open(pathName, "w") as fh:
-            fh.write(text)
+    with ThreadPoolExecutor(max_workers=min(32, (os.cpu_count() or 1) * 4)) as ex:
+        done = ex.map(fixLinks, pathNames, repeat(converted))
+        for (pathName, _) in zip(pathNames, done):
+            print(pathName)
+
+    nFailed = sum(len(group[2]) for group in notebookGroups) - len(convertedNotebooks)
+    if nFailed:
+        print(f"{nFailed} notebook(s) could not be converted")
+        return 1
 
 
 def main():
@@ -1,7 +1,10 @@
 import sys
 import os
 import collections
+import hashlib
+import pickle
 from subprocess import run
+from tempfile import NamedTemporaryFile
 
 from lxml import etree
 
@@ -33,6 +36,12 @@ The complete TEI schema is part of this package, you do not have to provide it.
 It has been generated on with the online TEI-Roma tool at
 https://roma.tei-c.org/startroma.php.
 
+Caching
+-------
+The interpretation of a schema is cached in `~/.cache/tt-xmlschema`.
+As long as a schema file does not change, subsequent analyses of it
+will use the cached interpretation.
+
 
 USAGE
 
@@ -51,23 +60,216 @@ It could very well be that I have missed parts of the semantics of XML-Schema.
 """
 
 
+CACHE_DIR = os.path.expanduser("~/.cache/tt-xmlschema")
+
+# Bump this whenever the interpretation of a schema or the format of the cache
+# changes, otherwise stale interpretations will be served from the cache.
+CACHE_VERSION = 5
+
+
+def cacheLocation(schema):
+    """Where the interpretation of a schema is cached.
+
+    Parameters
+    ----------
+    schema: string
+        The path of the xsd file.
+
+    Returns
+    -------
+    tuple
+        The path of the cache file, and the key that identifies the state
+        of the schema file: the cache is valid if it has been stored under the same key.
+    """
+    path = os.path.abspath(schema)
+    status = os.stat(path)
+    key = (CACHE_VERSION, path, status.st_mtime_ns, status.st_size)
+    fileName = hashlib.sha1(path.encode("utf8")).hexdigest()
+    return (f"{CACHE_DIR}/{fileName}.pkl", key)
+
+
+def readCache(location):
+    """Reads the cached definitions of a schema, if they are up to date.
+
+    Parameters
+    ----------
+    location: tuple
+        The cache file and key of the schema, as delivered by `cacheLocation()`.
+
+    Returns
+    -------
+    dict | void
+        The definitions as delivered by `Analysis.resolve()`, or None
+        if there is no up to date cache.
+    """
+    (cacheFile, key) = location
+
+    try:
+        with open(cacheFile, "rb") as fh:
+            (cachedKey, data) = pickle.load(fh)
+    except Exception:
+        return None
+
+    if cachedKey != key:
+        return None
+
+    return {name: Definition.fromData(infoData) for (name, infoData) in data.items()}
+
+
+def writeCache(location, definitions):
+    """Caches the definitions of a schema.
+
+    The cache file is written under a temporary name first, and then renamed,
+    so that there will never be a partially written cache file.
+    Failure to write the cache is not fatal.
+
+    We store plain data, not `Definition` objects, because the pickled class
+    would depend on how this module is invoked (`__main__` or `tt.xmlschema`).
+
+    Parameters
+    ----------
+    location: tuple
+        The cache file and key of the schema, as delivered by `cacheLocation()`.
+        It must have been determined *before* the schema was parsed, otherwise
+        a change of the schema file in the meantime would go unnoticed.
+    definitions: dict
+        The definitions as delivered by `Analysis.resolve()`.
+    """
+    (cacheFile, key) = location
+    data = {name: info.toData() for (name, info) in definitions.items()}
+    tmpName = None
+
+    try:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        with NamedTemporaryFile("wb", dir=CACHE_DIR, delete=False) as fh:
+            tmpName = fh.name
+            pickle.dump((key, data), fh)
+        os.replace(tmpName, cacheFile)
+        tmpName = None
+    except Exception as e:
+        print(f"Warning: could not cache the interpretation of {key[1]}")
+        print(str(e))
+    finally:
+        if tmpName is not None:
+            try:
+                os.remove(tmpName)
+            except OSError:
+                pass
+
+
+class Definition:
+    """What we know of a named definition in an xsd.
+
+    Attributes
+    ----------
+    tag: string
+        The local name of the xsd node that makes the definition,
+        e.g. `element` or `complexType`.
+    abstract: boolean
+        Whether the definition is abstract.
+    mixed: boolean
+        Whether the defined content is mixed.
+    subs: string | void
+        The name of the substitution group of the definition, if any.
+    kind: string | void
+        Whether the definition has a `simple` or `complex` type,
+        if known.
+    base: string | void
+        The name of the base of an extension in the definition, if any.
+    """
+
+    __slots__ = ("tag", "abstract", "mixed", "subs", "kind", "base")
+
+    def __init__(self, tag, abstract, mixed, subs):
+        self.tag = tag
+        self.abstract = abstract
+        self.mixed = mixed
+        self.subs = subs
+        self.kind = None
+        self.base = None
+
+    def toData(self):
+        """Delivers the contents as a tuple of plain values.
+
+        Returns
+        -------
+        tuple
+            The attributes, in the order of `__slots__`.
+        """
+        return tuple(getattr(self, attr) for attr in self.__slots__)
+
+    @classmethod
+    def fromData(cls, data):
+        """Makes a definition out of a tuple delivered by `toData()`.
+
+        Parameters
+        ----------
+        data: tuple
+            The attributes, in the order of `__slots__`.
+
+        Returns
+        -------
+        Definition
+        """
+        (tag, abstract, mixed, subs, kind, base) = data
+        info = cls(tag, abstract, mixed, subs)
+        info.kind = kind
+        info.base = base
+        return info
+
+
 class Analysis:
     types = set(
-        """
-        simpleType
-        complexType
-        """.strip().split()
+        map(
+            sys.intern,
+            """
+            simpleType
+            complexType
+            """.strip().split(),
+        )
     )
 
     notInteresting = set(
-        """
-        attribute
-        attributeGroup
-        group
-        """.strip().split()
+        map(
+            sys.intern,
+            """
+            attribute
+            attributeGroup
+            group
+            """.strip().split(),
+        )
+    )
+
+    # the lexical forms of the xs:boolean value true
+    trueValues = frozenset(("true", "1"))
+
+    xsNs = dict(xs="http://www.w3.org/2001/XMLSchema")
+
+    # Note that we avoid `//` in these expressions:
+    # `descendant-or-self::` is several times faster in lxml.
+
+    # all named definitions
+    findNamed = etree.XPath("descendant-or-self::xs:*[@name != '']", namespaces=xsNs)
+
+    # the named elements that are not underneath another named element
+    findElementDefs = etree.XPath(
+        "descendant-or-self::xs:element[@name != '']"
+        "[not(ancestor::xs:element[@name != ''])]",
+        namespaces=xsNs,
+    )
+
+    # the type definitions directly below a node
+    findTypes = etree.XPath(
+        "*[" + " or ".join(f"self::xs:{t}" for t in sorted(types)) + "]",
+        namespaces=xsNs,
     )
 
-    def __init__(self, baseSchema, override=None, debug=False):
+    # the bases of the extensions below the children of a node
+    findBases = etree.XPath(
+        "*/descendant::xs:extension/@base[. != '']", namespaces=xsNs
+    )
+
+    def __init__(self, baseSchema, override=None, debug=False, cache=True):
         """Extracts meaningful information from an XML Schema.
 
         When parsing XML it is sometimes needed to know the properties of the current
@@ -94,30 +296,44 @@ class Analysis:
         debug: boolean, optional False
             Whether to run in debug mode or not.
             In debug mode more information is printed on the console.
+        cache: boolean, optional True
+            Whether to use a cache of interpreted schemas.
+            If a schema file has not changed since its interpretation has been
+            cached, it will not be parsed again, the cached interpretation
+            will be used instead.
+            In debug mode the cache is not used, so that the interpretation
+            actually happens and can be followed on the console.
         """
 
         self.debug = debug
+        self.cache = cache and not debug
 
-        try:
-            with open(baseSchema) as fh:
-                tree = etree.parse(fh)
+        def read(schema):
+            # the cache key is determined before parsing, so that it reflects
+            # the state of the file as it is parsed, or older
+            location = cacheLocation(schema) if self.cache else None
+            cached = None if location is None else readCache(location)
+            if cached is not None:
+                return (None, cached, location)
 
-            self.root = tree.getroot()
+            return (etree.parse(schema).getroot(), None, location)
+
+        try:
+            (self.root, self.cached, self.location) = read(baseSchema)
 
             self.oroot = None
+            self.ocached = None
+            self.olocation = None
 
             if override is not None:
-                with open(baseSchema) as fh:
-                    otree = etree.parse(fh)
-
-                self.oroot = otree.getroot()
+                (self.oroot, self.ocached, self.olocation) = read(override)
 
             self.good = True
 
         except Exception as e:
             msg = f"Could not read and parse {baseSchema}"
             if override is not None:
-                msg += " or {override}"
+                msg += f" or {override}"
             print(msg)
             print(str(e))
             self.good = False
@@ -128,7 +344,7 @@ class Analysis:
 
         Parameters
         ----------
-        x: (str, dict)
+        x: (str, Definition)
             The element name and the element info.
 
         Returns
@@ -138,8 +354,8 @@ class Analysis:
             and within xs:element those that are "abstract" come first.
         """
         name = x[0]
-        tag = x[1]["tag"]
-        abstract = x[1]["abstract"]
+        tag = x[1].tag
+        abstract = x[1].abstract
 
         return (
             "0" if tag == "simpleType" else "1" if tag == "complexType" else tag,
@@ -162,9 +378,8 @@ class Analysis:
         When elements refer to a *base*, they need to get
         the *kind* and *mixed* attributes of an extension with that *base*.
 
-        After an initial parse of the XSD file, we do a variable number of
-        resolving rounds, where we chase the substitution groups and
-        extensions, until nothing changes anymore.
+        After an initial parse of the XSD file, we resolve the definitions,
+        where we chase the substitution groups and extensions.
 
         Parameters
         ----------
@@ -185,75 +400,98 @@ class Analysis:
 
         debug = self.debug
         root = self.root
-        types = self.types
+        notInteresting = self.notInteresting
+        trueValues = self.trueValues
+        intern = sys.intern
 
         definitions = {}
         redefinitions = collections.Counter()
 
-        def findDefs(node, definingName, topDef):
-            """Inner function to walk through the xsd and get definitions.
+        def findDefs(root):
+            """Inner function to get the definitions out of the xsd.
+
+            Instead of walking through the whole xsd, we let `lxml` select
+            the relevant nodes by means of compiled XPath expressions.
+
+            First we collect all named nodes, in document order, so that the
+            first definition of a name wins.
 
-            This function is called recursively for child nodes.
+            Then we visit the top-level element definitions, i.e. the
+            named elements that are not underneath another named element,
+            and pick up their kind, mixedness and base from the type
+            definitions directly below them and the extensions deeper below them.
 
             Parameters
             ----------
-            node: Object
-                The current node.
-            definingName: string | void
-                If this has a value, we are underneath a definition.
-
-            topDef: boolean
-                If we are underneath a definition, this indicates
-                we are at the top-level of that definition.
+            root: Object
+                The root node.
             """
-            tag = etree.QName(node.tag).localname
-
-            name = node.get("name")
-            abstract = node.get("abstract") == "true"
-            mixed = node.get("mixed") == "true"
-            subs = node.get("substitutionGroup")
-
-            if definingName:
-                if topDef:
-                    if tag in types:
-                        definitions[definingName]["kind"] = (
-                            "simple" if tag == "simpleType" else "complex"
-                        )
-                        if mixed:
-                            definitions[definingName]["mixed"] = mixed
-                else:
-                    if tag == "extension":
-                        base = node.get("base")
-                        if base:
-                            definitions[definingName]["base"] = base
+            for node in self.findNamed(root):
+                tag = node.tag
+                if tag[0] == "{":
+                    tag = tag[tag.rfind("}") + 1 :]
+                tag = intern(tag)
+
+                if tag in notInteresting:
+                    continue
+
+                get = node.get
+                name = intern(get("name"))
 
-            if name and tag not in self.notInteresting:
                 if name in definitions:
                     redefinitions[name] += 1
                 else:
-                    definitions[name] = dict(
-                        tag=tag, abstract=abstract, mixed=mixed, subs=subs
+                    definitions[name] = Definition(
+                        tag,
+                        get("abstract") in trueValues,
+                        get("mixed") in trueValues,
+                        get("substitutionGroup"),
+                    )
+
+            findTypes = self.findTypes
+            findBases = self.findBases
+
+            for node in self.findElementDefs(root):
+                info = definitions[node.get("name")]
+
+                for typeNode in findTypes(node):
+                    info.kind = (
+                        "simple"
+                        if typeNode.tag.endswith("}simpleType")
+                        else "complex"
                     )
+                    if typeNode.get("mixed") in trueValues:
+                        info.mixed = True
+
+                bases = findBases(node)
+                if bases:
+                    info.base = bases[-1]
+
+        def getDefs(root, location, cached):
+            nonlocal definitions
+            nonlocal redefinitions
 
-            if definingName:
-                defining = definingName
-                top = False
-            else:
-                isElementDef = name and tag == "element"
-                defining = name if isElementDef else False
-                top = True if defining else False
+            if cached is not None:
+                definitions = cached
+                return
 
-            for child in node.iterchildren(tag=etree.Element):
-                findDefs(child, defining, top)
+            definitions = {}
+            redefinitions = collections.Counter()
+            findDefs(root)
+            if debug:
+                self.printElems(definitions, redefinitions)
+            self.resolve(definitions)
+            if location is not None:
+                writeCache(location, definitions)
 
-        findDefs(root, False, False)
-        if debug:
-            self.printElems()
-        self.resolve(definitions)
+        getDefs(root, self.location, self.cached)
 
-        baseDefinitions = definitions
+        # from now on we only need the interpretation of the schema, not its tree
+        (self.root, self.cached) = (None, definitions)
+        baseDefinitions = dict(definitions)
 
         oroot = self.oroot
+        ocached = self.ocached
 
         def repMixed(m):
             return "-----" if m is None else "mixed" if m else "pure"
@@ -263,21 +501,17 @@ class Analysis:
 
         self.overrides = {}
 
-        if oroot is not None:
-            definitions = {}
-            redefinitions = collections.Counter()
-            findDefs(oroot, False, False)
-            if debug:
-                self.printElems()
-            self.resolve(definitions)
+        if oroot is not None or ocached is not None:
+            getDefs(oroot, self.olocation, ocached)
+            (self.oroot, self.ocached) = (None, definitions)
 
             for (name, odef) in definitions.items():
-                if name in definitions:
+                if name in baseDefinitions:
                     baseDef = baseDefinitions[name]
-                    baseKind = repKind(baseDef.get("kind", None))
-                    baseMixed = repMixed(baseDef.get("mixed", None))
-                    oKind = repKind(odef.get("kind", None))
-                    oMixed = repMixed(odef.get("mixed", None))
+                    baseKind = repKind(baseDef.kind)
+                    baseMixed = repMixed(baseDef.mixed)
+                    oKind = repKind(odef.kind)
+                    oMixed = repMixed(odef.mixed)
                     transRep = (
                         f"{baseKind} {baseMixed} ==> {oKind} {oMixed}"
                         if baseKind != oKind and baseMixed != oMixed
@@ -290,10 +524,15 @@ class Analysis:
                     if transRep is not None:
                         baseDefinitions[name] = odef
                     self.overrides[name] = transRep
+        # For the non-abstract elements the sort key of `eKey()` boils down
+        # to the name, so we filter first and sort the tuples by their names,
+        # which are unique, without calling a key function.
         defs = tuple(
-            (name, info.get("kind", None), info.get("mixed", None))
-            for (name, info) in sorted(baseDefinitions.items(), key=self.eKey)
-            if info["tag"] == "element" and not info["abstract"]
+            sorted(
+                (name, info.kind, info.mixed)
+                for (name, info) in baseDefinitions.items()
+                if info.tag == "element" and not info.abstract
+            )
         )
         return (
             "\n".join(
@@ -310,77 +549,116 @@ class Analysis:
         After having read the complete XSD file,
         we can now dereference names and fill properties of their definitions
         in places where the names occur.
+
+        Every definition refers to at most one other definition, by means of its
+        *base* or *substitutionGroup*. We visit these references from the roots
+        downwards, where each definition passes its properties on to the
+        definitions that refer to it. That way most definitions are visited
+        only once.
+
+        A definition that refers to itself counts as a root. This happens when an
+        element and a type share a name, because they share an entry in the
+        definitions.
+
+        The definitions that are not reached from a root are in or below a cycle
+        of references. For those we do rounds of inference until nothing changes
+        anymore.
         """
         debug = self.debug
 
-        def infer():
+        def inherit(info, other, otherInfo):
+            if info.mixed:
+                return 0
+
             changed = 0
-            for (name, info) in definitions.items():
-                if info["mixed"]:
-                    continue
 
-                other = info.get("base", info.get("subs", None))
-                if other:
-                    otherBare = other.split(":", 1)[-1]
-                    otherInfo = definitions.get(otherBare, None)
-                    if otherInfo is None:
-                        print(f"Warning: {other} is not defined.")
-                        continue
-                    if otherInfo["mixed"]:
-                        info["mixed"] = True
-                        changed += 1
-                    if info.get("kind", None) is None:
-                        if otherInfo.get("kind", None):
-                            info["kind"] = otherInfo["kind"]
-                            changed += 1
-                        else:
-                            print(f"Warning: {other}.kind is not defined.")
-                    if info.get("mixed", None) is None:
-                        if otherInfo.get("mixed", None):
-                            info["mixed"] = otherInfo["mixed"]
-                            changed += 1
-                        else:
-                            print(f"Warning: {other}.mixed is not defined.")
+            if otherInfo.mixed:
+                info.mixed = True
+                changed += 1
+            if info.kind is None:
+                if otherInfo.kind:
+                    info.kind = otherInfo.kind
+                    changed += 1
+                else:
+                    print(f"Warning: {other}.kind is not defined.")
 
             return changed
 
-        i = 0
+        children = collections.defaultdict(list)
+        parents = {}
+        todo = collections.deque()
+
+        for (name, info) in definitions.items():
+            other = info.base or info.subs
+            if other:
+                otherBare = other.split(":", 1)[-1]
+                if otherBare in definitions:
+                    if otherBare != name:
+                        children[otherBare].append((name, other))
+                        parents[name] = (otherBare, other)
+                        continue
+                else:
+                    print(f"Warning: {other} is not defined.")
+            todo.append(name)
+
+        changed = 0
+        visited = set()
+
+        while todo:
+            otherName = todo.popleft()
+            visited.add(otherName)
+            otherInfo = definitions[otherName]
+
+            for (name, other) in children.get(otherName, ()):
+                todo.append(name)
+                changed += inherit(definitions[name], other, otherInfo)
 
-        while True:
-            changed = infer()
-            i += 1
-            if changed:
-                print(f"round {i:>3}: {changed:>3} changes")
-                if debug:
-                    self.printElems()
-            else:
+        rest = [name for name in definitions if name not in visited]
+
+        while rest:
+            thisChanged = 0
+            for name in rest:
+                (otherBare, other) = parents[name]
+                thisChanged += inherit(definitions[name], other, definitions[otherBare])
+            if not thisChanged:
                 break
+            changed += thisChanged
+
+        if changed:
+            print(f"resolved: {changed:>3} changes")
+            if debug:
+                self.printElems(definitions)
 
-    def printElems(self):
+    def printElems(self, definitions, redefinitions=None):
         """Pretty print the current state of definitions.
 
         Mainly for debugging.
-        """
-        definitions = self.definitions
-        redefinitions = self.redefinitions
 
+        Parameters
+        ----------
+        definitions: dict
+            The definitions, keyed by name, valued by `Definition` objects.
+        redefinitions: collections.Counter, optional None
+            How many times names have been defined again.
+        """
         for (name, info) in sorted(definitions.items(), key=self.eKey):
-            tag = info["tag"]
-            mixed = "mixed" if info["mixed"] else "-----"
-            abstract = "abstract" if info["abstract"] else "--------"
-            kind = info.get("kind", "---")
-            subs = info.get("subs")
+            tag = info.tag
+            mixed = "mixed" if info.mixed else "-----"
+            abstract = "abstract" if info.abstract else "--------"
+            kind = info.kind or "---"
+            subs = info.subs
             subsRep = f"==> {subs}" if subs else ""
-            base = info.get("base")
+            base = info.base
             baseRep = f"<== {base}" if base else ""
             print(
                 f"{name:<30} in {tag:<20} "
                 f"({kind:<7}) ({mixed}) ({abstract}) {subsRep}{baseRep}"
             )
 
-        print("=============================================")
-        for (name, amount) in sorted(redefinitions.items()):
-            print(f"{amount:>3}x {name}")
+        if redefinitions is not None:
+            print("=============================================")
+            for (name, amount) in sorted(redefinitions.items()):
+                print(f"{amount:>3}x {name}")
 
 
 TASKS = dict(
@@ -446,7 +724,11 @@ def main():
         myDir = os.path.dirname(os.path.abspath(__file__))
         trang = f"{myDir}/trang/trang.jar"
         schemaOut = schemaFile.removesuffix(".rng") + ".xsd"
-        return run(f"java -jar {trang} {schemaFile} {schemaOut}", shell=True)
+        try:
+            return run(["java", "-jar", trang, schemaFile, schemaOut]).returncode
+        except FileNotFoundError:
+            print("Cannot run java, is it installed?")
+            return 1
 
 
 if __name__ == "__main__":